@@ -1,34 +1,71 @@
-from functools import partial
+import os
+import threading
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from typing import Any, Callable, List, Optional, Sequence
 
 import torch
 from torch import nn, Tensor
+import torch.nn.functional as F
 
-from network.mynn import forgiving_state_restore
 from torch.utils.model_zoo import load_url as load_state_dict_from_url
 from .instance_whitening import InstanceWhitening
 
-__all__ = ["MobileNetV3", "mobilenet_v3"]
+__all__ = ["MobileNetV3", "mobilenet_v3", "quantize_mobilenet_v3", "export_mobile", "export_tensorrt",
+           "collect_whitening"]
 
 model_urls = {
     'mobilenet_v3': 'https://download.pytorch.org/models/mobilenet_v3_small-047dcff4.pth',
 }
 
+# torchvision key fragment -> ours; the inverted residual body is `conv` here
+_torchvision_renames = {
+    '.block.': '.conv.',
+}
+
+
+# Per-thread target list for the InstanceWhitening hooks, so DataParallel
+# replicas running in parallel threads never share a list.
+_whitening_sink = threading.local()
+
+
+@contextmanager
+def collect_whitening(w_arr: List[Tensor]):
+    """
+    Append the whitening outputs of every InstanceWhitening block run in
+    this thread inside the with-block to w_arr. Outside the block they are
+    dropped.
+    """
+    prev = getattr(_whitening_sink, "w_arr", None)
+    _whitening_sink.w_arr = w_arr
+    try:
+        yield w_arr
+    finally:
+        _whitening_sink.w_arr = prev
+
+
+def _collect_w(module: nn.Module, inp: Any, out: Any) -> None:
+    w_arr = getattr(_whitening_sink, "w_arr", None)
+    if w_arr is not None:
+        w_arr.append(out[1])
+
 
 class SqueezeExcitation(torch.nn.Module):
+    # constant for TorchScript, so the iw branches and the None instance_norm_layer are pruned
+    __constants__ = ["iw"]
+
     def __init__(
         self,
         input_channels: int,
         squeeze_channels: int,
-        activation: Callable[..., torch.nn.Module] = torch.nn.ReLU(),
+        activation: Callable[..., torch.nn.Module] = partial(torch.nn.ReLU, inplace=True),
         scale_activation: Callable[..., torch.nn.Module] = torch.nn.Sigmoid,
         iw: int = 0
     ) -> None:
         super().__init__()
-        self.avgpool = torch.nn.AdaptiveAvgPool2d(1)
         self.fc1 = torch.nn.Conv2d(input_channels, squeeze_channels, 1)
         self.fc2 = torch.nn.Conv2d(squeeze_channels, input_channels, 1)
-        self.activation = activation
+        self.activation = activation()
         self.scale_activation = scale_activation()
         self.iw = iw
         if iw == 1:
@@ -40,31 +77,25 @@ class SqueezeExcitation(torch.nn.Module):
         elif iw == 4:
             self.instance_norm_layer = nn.InstanceNorm2d(squeeze_channels, affine=True)
         else:
-            self.instance_norm_layer = nn.Sequential()
+            self.instance_norm_layer = None
 
     def _scale(self, inp):
-        scale = self.avgpool(inp)
-        scale = self.fc1(scale)
+        # the 1x1 convs act on a 1x1 map, so run them as GEMMs on the pooled vector
+        scale = inp.mean((2, 3))
+        scale = F.linear(scale, self.fc1.weight.flatten(1), self.fc1.bias)
         scale = self.activation(scale)
-        scale = self.fc2(scale)
-        scale = self.instance_norm_layer(scale)
+        scale = F.linear(scale, self.fc2.weight.flatten(1), self.fc2.bias)
+        scale = scale[:, :, None, None]
         return self.scale_activation(scale)
 
-    def forward(self, x_tuple):
-        if len(x_tuple) == 2:
-            x = x_tuple[0]
-            w_arr = x_tuple[1]
-        else:
-            print("error in SE")
-            return
+    def forward(self, x: Tensor) -> Tensor:
         scale = self._scale(x)
-        if self.iw >= 1:
+        if self.iw != 0:
             if self.iw == 1 or self.iw == 2:
-                scale, w = self.instance_norm_layer(scale)
-                w_arr.append(w)
+                scale, _ = self.instance_norm_layer(scale)
             else:
                 scale = self.instance_norm_layer(scale)
-        return [scale * x, w_arr]
+        return scale * x
 
 
 def _make_divisible(v: float, divisor: int, min_value: Optional[int] = None) -> int:
@@ -77,6 +108,8 @@ def _make_divisible(v: float, divisor: int, min_value: Optional[int] = None) ->
 
 
 class ConvNormActivation(nn.Sequential):
+    __constants__ = ["iw", "has_activation"]
+
     def __init__(
         self,
         in_planes: int,
@@ -86,7 +119,7 @@ class ConvNormActivation(nn.Sequential):
         groups: int = 1,
         dilation: int = 1,
         norm_layer: Optional[Callable[..., nn.Module]] = None,
-        activation_layer: Optional[Callable[..., torch.nn.Module]] = torch.nn.ReLU(inplace=True),
+        activation_layer: Optional[Callable[..., torch.nn.Module]] = partial(torch.nn.ReLU, inplace=True),
         iw: int = 0,
     ) -> None:
 
@@ -95,6 +128,7 @@ class ConvNormActivation(nn.Sequential):
             norm_layer = nn.BatchNorm2d
 
         self.iw = iw
+        self.has_activation = activation_layer is not None
 
         if iw == 1:
             instance_norm_layer = InstanceWhitening(out_planes)
@@ -105,43 +139,62 @@ class ConvNormActivation(nn.Sequential):
         elif iw == 4:
             instance_norm_layer = nn.InstanceNorm2d(out_planes, affine=True)
         else:
-            instance_norm_layer = nn.Sequential()
-        if activation_layer is None:
-            super(ConvNormActivation, self).__init__(
-                nn.Conv2d(in_planes, out_planes, kernel_size, stride, padding, dilation=dilation, groups=groups, bias=False),
-                norm_layer(out_planes),
-                instance_norm_layer
-            )
-        else:
-            super(ConvNormActivation, self).__init__(
-                nn.Conv2d(in_planes, out_planes, kernel_size, stride, padding, dilation=dilation, groups=groups,
-                          bias=False),
-                norm_layer(out_planes),
-                activation_layer,
-                instance_norm_layer
-            )
-        self.instance_norm_layer = instance_norm_layer
+            instance_norm_layer = None
 
-    def forward(self, x_tuple):
-        if len(x_tuple) == 2:
-            w_arr = x_tuple[1]
-            x = x_tuple[0]
-        else:
-            print("error in BN forward path")
-            return
+        layers: List[nn.Module] = [
+            nn.Conv2d(in_planes, out_planes, kernel_size, stride, padding, dilation=dilation, groups=groups, bias=False),
+            norm_layer(out_planes),
+        ]
+        if activation_layer is not None:
+            # a fresh module per block, so quantization observes each activation separately
+            layers.append(activation_layer())
+        # the plain iw == 0 block carries no instance normalization at all
+        if instance_norm_layer is not None:
+            layers.append(instance_norm_layer)
+        # the instance-norm layer is reached by position only; registering it again
+        # under a name would make the Sequential walk in forward() run it twice
+        super(ConvNormActivation, self).__init__(*layers)
 
-        for i, module in enumerate(self):
-            if i == len(self) - 1:
-                if self.iw >= 1:
-                    if self.iw == 1 or self.iw == 2:
-                        x, w = self.instance_norm_layer(x)
-                        w_arr.append(w)
-                    else:
-                        x = self.instance_norm_layer(x)
-            else:
-                x = module(x)
+    def forward(self, x: Tensor) -> Tensor:
+        # walk the children in order; the instance-norm layer, when present, is the last one
+        for module in self:
+            x = module(x)
+        if self.iw == 1 or self.iw == 2:
+            # InstanceWhitening returns (x, w); w is picked up by its forward hook (collect_whitening)
+            x = x[0]
+
+        return x
 
-        return [x, w_arr]
+    @torch.no_grad()
+    def fuse(self) -> None:
+        """
+        Fold the BatchNorm running statistics into the preceding conv so that
+        inference runs a single conv with bias. Only valid in eval mode; blocks
+        carrying instance whitening (iw 1/2) are left untouched. When an
+        InstanceNorm (iw 3/4) directly follows the BN, its mean subtraction
+        cancels the BN shift, so only the BN scale is kept and the block runs
+        conv -> InstanceNorm.
+        """
+        conv, bn = self[0], self[1]
+        if self.iw == 1 or self.iw == 2 or not isinstance(bn, nn.BatchNorm2d):
+            return
+        shift_cancelled = self.iw != 0 and not self.has_activation
+        scale = torch.rsqrt(bn.running_var + bn.eps)
+        if bn.weight is not None:
+            scale = scale * bn.weight
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        bias = (bias - bn.running_mean) * scale
+        if bn.bias is not None:
+            bias = bias + bn.bias
+
+        fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride, conv.padding,
+                          dilation=conv.dilation, groups=conv.groups,
+                          bias=not shift_cancelled).to(device=conv.weight.device, dtype=conv.weight.dtype)
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        if not shift_cancelled:
+            fused.bias.copy_(bias)
+        self[0] = fused
+        self[1] = nn.Identity()
 
 
 Conv2dNormActivation = ConvNormActivation
@@ -172,17 +225,20 @@ class InvertedResidualConfig:
         self.iw = iw
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def adjust_channels(channels: int, width_mult: float):
         return _make_divisible(channels * width_mult, 8)
 
 
 class InvertedResidual(nn.Module):
     # Implemented as described at section 5 of MobileNetV3 paper
+    __constants__ = ["iw"]
+
     def __init__(
         self,
         cnf: InvertedResidualConfig,
         norm_layer: Callable[..., nn.Module],
-        se_layer: Callable[..., nn.Module] = partial(SqueezeExcitation, scale_activation=nn.Hardsigmoid),
+        se_layer: Callable[..., nn.Module] = partial(SqueezeExcitation, scale_activation=partial(nn.Hardsigmoid, inplace=True)),
     ):
         super().__init__()
         if not (1 <= cnf.stride <= 2):
@@ -193,7 +249,7 @@ class InvertedResidual(nn.Module):
         self.iw = cnf.iw
         self.expand_ratio = cnf.expanded_channels
         layers: List[nn.Module] = []
-        activation_layer = nn.Hardswish() if cnf.use_hs else nn.ReLU(inplace=True)
+        activation_layer = partial(nn.Hardswish, inplace=True) if cnf.use_hs else partial(nn.ReLU, inplace=True)
 
         # expand
         if cnf.expanded_channels != cnf.input_channels:
@@ -242,49 +298,25 @@ class InvertedResidual(nn.Module):
         elif cnf.iw == 4:
             self.instance_norm_layer = nn.InstanceNorm2d(cnf.out_channels, affine=False)
         else:
-            self.instance_norm_layer = nn.Sequential()
+            self.instance_norm_layer = None
         self.conv = nn.Sequential(*layers)
         self.out_channels = cnf.out_channels
         self._is_cn = cnf.stride > 1
+        # plain add in float, quantized add once the model is converted to int8
+        self.skip_add = nn.quantized.FloatFunctional()
 
-    def forward(self, x_tuple):
-        if len(x_tuple) == 2:
-            x = x_tuple[0]
-        else:
-            print("error in invert residual forward path")
-            return
-        if self.cnf.expanded_channels != self.cnf.input_channels:
-            print(self.conv[0])
-            x_tuple = self.conv[0](x_tuple)
-            print(self.conv[1])
-            x_tuple = self.conv[1](x_tuple)
-            print(self.conv[2])
-            x_tuple = self.conv[2](x_tuple)
-            if len(self.conv) >3:
-              x_tuple = self.conv[3](x_tuple)
-        else:
-            print(self.conv[0])
-            x_tuple = self.conv[0](x_tuple)
-            print(self.conv[1])
-            x_tuple = self.conv[1](x_tuple)
-            print(self.conv[2])
-            x_tuple = self.conv[2](x_tuple)
-
-        conv_x = x_tuple[0]
-        w_arr = x_tuple[1]
+    def forward(self, x: Tensor) -> Tensor:
+        out = self.conv(x)
         if self.use_res_connect:
-            x = x + conv_x
-        else:
-            x = conv_x
+            out = self.skip_add.add(x, out)
 
-        if self.iw >= 1:
+        if self.iw != 0:
             if self.iw == 1 or self.iw == 2:
-                x, w = self.instance_norm_layer(x)
-                w_arr.append(w)
+                out, _ = self.instance_norm_layer(out)
             else:
-                x = self.instance_norm_layer(x)
+                out = self.instance_norm_layer(out)
 
-        return [x, w_arr]
+        return out
 
 
 class MobileNetV3(nn.Module):
@@ -297,6 +329,7 @@ class MobileNetV3(nn.Module):
         norm_layer: Optional[Callable[..., nn.Module]] = None,
         dropout: float = 0.2,
         iw: list = [0, 0, 0, 0, 0, 0, 0],
+        fp16: bool = False,
         **kwargs: Any,
     ) -> None:
         super().__init__()
@@ -325,7 +358,7 @@ class MobileNetV3(nn.Module):
                 kernel_size=3,
                 stride=2,
                 norm_layer=norm_layer,
-                activation_layer=nn.Hardswish(),
+                activation_layer=partial(nn.Hardswish, inplace=True),
             )
         )
         feature_count = 0
@@ -350,11 +383,17 @@ class MobileNetV3(nn.Module):
                 lastconv_output_channels,
                 kernel_size=1,
                 norm_layer=norm_layer,
-                activation_layer=nn.Hardswish(),
+                activation_layer=partial(nn.Hardswish, inplace=True),
             )
         )
 
         self.features = nn.Sequential(*layers)
+        self.fp16 = fp16
+        self._cuda_graph = None
+        self._static_input = None
+        self._static_output = None
+        self.quant = torch.quantization.QuantStub()
+        self.dequant = torch.quantization.DeQuantStub()
         self.avgpool = nn.AdaptiveAvgPool2d(1)
         self.classifier = nn.Sequential(
             nn.Linear(lastconv_output_channels, last_channel),
@@ -375,19 +414,248 @@ class MobileNetV3(nn.Module):
                 nn.init.normal_(m.weight, 0, 0.01)
                 nn.init.zeros_(m.bias)
 
+        # Whitening outputs are collected by hooks into the caller's
+        # collect_whitening list, so the blocks stay Tensor -> Tensor.
+        for m in self.modules():
+            if isinstance(m, InstanceWhitening):
+                m.register_forward_hook(_collect_w)
+
     def _forward_impl(self, x: Tensor) -> Tensor:
+        x = self.quant(x)
         x = self.features(x)
 
         x = self.avgpool(x)
         x = torch.flatten(x, 1)
 
-        x = self.classifier(x)
+        if self.training:
+            x = self.classifier(x)
+        else:
+            x = self._infer_head(x)
+        x = self.dequant(x)
 
         return x
 
-    def forward(self, x: Tensor) -> Tensor:
+    def _infer_head(self, x: Tensor) -> Tensor:
+        # Linear -> Hardswish -> Linear; Dropout is the identity at inference and is skipped
+        x = self.classifier[0](x)
+        x = self.classifier[1](x)
+        return self.classifier[3](x)
+
+    def _forward_eager(self, x: Tensor) -> Tensor:
+        if self.fp16:
+            # channel counts are multiples of 8, so the 1x1 convs and the classifier map onto Tensor Cores
+            with torch.cuda.amp.autocast():
+                return self._forward_impl(x)
         return self._forward_impl(x)
 
+    def forward(self, x: Tensor) -> Tensor:
+        if self._replays_cuda_graph(x):
+            self._static_input.copy_(x)
+            self._cuda_graph.replay()
+            return self._static_output
+        return self._forward_eager(x)
+
+    def _replays_cuda_graph(self, x: Tensor) -> bool:
+        # tracing/ONNX export must record the real ops, not a copy into the static input
+        if self._cuda_graph is None or self.training or torch.is_grad_enabled():
+            return False
+        if torch.jit.is_tracing() or torch.onnx.is_in_onnx_export():
+            return False
+        static = self._static_input
+        return x.shape == static.shape and x.device == static.device and x.dtype == static.dtype
+
+    def capture_cuda_graph(self, input_size: Sequence[int], warmup: int = 3) -> "MobileNetV3":
+        """
+        Record the eval forward pass for a fixed input shape as a single CUDA
+        graph, removing the per-kernel launch latency that dominates at batch 1.
+        Inputs of that shape are then served by replaying the graph; the output
+        tensor is reused by the next call, so clone it if it must be kept.
+        Other shapes, devices or dtypes, training mode, grad-enabled calls and
+        tracing/ONNX export fall back to the eager path. The graph reads the parameter storage present at capture
+        time, so capture last: fuse() and flatten_features() drop the graph,
+        and .to()/.half()/.cuda() after capture need release_cuda_graph() and
+        a fresh capture.
+        """
+        self.eval()
+        param = next(self.parameters())
+        static_input = torch.zeros(*input_size, device=param.device, dtype=param.dtype)
+
+        # warm up on a side stream so cuDNN/allocator setup is not captured
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.no_grad(), torch.cuda.stream(stream):
+            for _ in range(warmup):
+                self._forward_eager(static_input)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.no_grad(), torch.cuda.graph(graph):
+            static_output = self._forward_eager(static_input)
+
+        self._cuda_graph = graph
+        self._static_input = static_input
+        self._static_output = static_output
+        return self
+
+    def release_cuda_graph(self) -> None:
+        self._cuda_graph = None
+        self._static_input = None
+        self._static_output = None
+
+    def flatten_features(self) -> "MobileNetV3":
+        """
+        Replace the features Sequential with a torch.fx GraphModule whose forward
+        is a single straight-line chain of leaf-module calls. The GraphModule only
+        keeps the path each module is called through; parameter names still match
+        the Sequential trunk because every parametrised module has exactly one
+        path (ConvNormActivation holds its instance norm by position only). The
+        trunk can no longer be indexed block by block, so call fuse() and
+        quantize_mobilenet_v3() before this, not after.
+        """
+        import torch.fx
+
+        class Tracer(torch.fx.Tracer):
+            def is_leaf_module(self, m: nn.Module, qualname: str) -> bool:
+                # keep whitening opaque so its forward hook still feeds collect_whitening
+                return isinstance(m, InstanceWhitening) or super().is_leaf_module(m, qualname)
+
+        graph = Tracer().trace(self.features)
+        self.features = torch.fx.GraphModule(self.features, graph)
+        self.release_cuda_graph()
+        return self
+
+    def fuse(self) -> "MobileNetV3":
+        """
+        Switch to eval mode and fold every Conv+BN pair into a single conv.
+        Call on CPU before moving the model to the GPU; the fused model can no
+        longer be trained.
+        """
+        if not isinstance(self.features, nn.Sequential):
+            raise RuntimeError("fuse() must be called before flatten_features()")
+        self.eval()
+        for m in self.modules():
+            if isinstance(m, ConvNormActivation):
+                m.fuse()
+        self.release_cuda_graph()
+        return self
+
+
+class _FloatBlock(nn.Module):
+    """
+    Runs the wrapped block in float inside an int8 model.
+    """
+    def __init__(self, block: nn.Module) -> None:
+        super().__init__()
+        self.dequant = torch.quantization.DeQuantStub()
+        self.block = block
+        self.block.qconfig = None
+        self.quant = torch.quantization.QuantStub()
+
+    def forward(self, x: Tensor) -> Tensor:
+        return self.quant(self.block(self.dequant(x)))
+
+
+def quantize_mobilenet_v3(model: MobileNetV3, calib_loader, backend: str = "fbgemm",
+                          num_batches: Optional[int] = None) -> MobileNetV3:
+    """
+    Post-training static int8 quantization of a CPU MobileNetV3 (iw == 0).
+    Use backend 'fbgemm' on x86 and 'qnnpack' on ARM.
+    Conv+BN(+ReLU) groups are fused, the SE blocks stay in float and the
+    model is calibrated on calib_loader before conversion. Hardswish is
+    swapped for its quantized counterpart by convert().
+    """
+    if not isinstance(model.features, nn.Sequential):
+        raise RuntimeError("quantize_mobilenet_v3() must be called before flatten_features()")
+    if any(getattr(m, "iw", 0) != 0 for m in model.modules()):
+        raise ValueError("quantize_mobilenet_v3() only supports models built with iw == 0")
+    torch.backends.quantized.engine = backend
+    model.eval()
+
+    for m in list(model.modules()):
+        if isinstance(m, ConvNormActivation) and m.iw == 0 and isinstance(m[1], nn.BatchNorm2d):
+            if m.has_activation and isinstance(m[2], nn.ReLU):
+                torch.quantization.fuse_modules(m, ["0", "1", "2"], inplace=True)
+            else:
+                torch.quantization.fuse_modules(m, ["0", "1"], inplace=True)
+        elif isinstance(m, InvertedResidual):
+            for i, layer in enumerate(m.conv):
+                if isinstance(layer, SqueezeExcitation):
+                    m.conv[i] = _FloatBlock(layer)
+
+    model.qconfig = torch.quantization.get_default_qconfig(backend)
+    torch.quantization.prepare(model, inplace=True)
+    with torch.no_grad():
+        for i, batch in enumerate(calib_loader):
+            if num_batches is not None and i >= num_batches:
+                break
+            images = batch[0] if isinstance(batch, (list, tuple)) else batch
+            model(images)
+    torch.quantization.convert(model, inplace=True)
+    return model
+
+
+def export_mobile(model: nn.Module, path: str, input_size: Sequence[int] = (1, 3, 224, 224),
+                  backend: Optional[str] = None) -> None:
+    """
+    Trace the model, run the mobile optimizer passes and save it for the
+    PyTorch Lite interpreter. Pass backend='qnnpack' for quantized ARM targets.
+    """
+    from torch.utils.mobile_optimizer import optimize_for_mobile
+
+    if backend is not None:
+        torch.backends.quantized.engine = backend
+    model.eval()
+    # converted int8 models hold packed weights rather than parameters and live on the CPU
+    param = next(model.parameters(), None)
+    device = param.device if param is not None else torch.device("cpu")
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.randn(*input_size, device=device))
+    optimized = optimize_for_mobile(traced)
+    optimized._save_for_lite_interpreter(path)
+
+
+def export_tensorrt(model: nn.Module, path: str, input_size: Sequence[int] = (1, 3, 224, 224), fp16: bool = True,
+                    int8_calib=None, opset_version: int = 12) -> str:
+    """
+    Export the model to ONNX next to path and, when torch_tensorrt is
+    installed, compile a TensorRT TorchScript module and save it at path.
+    int8_calib is a DataLoader used for entropy (v2) INT8 calibration.
+    Without torch_tensorrt the ONNX path is returned for trtexec, e.g.
+    trtexec --onnx=<onnx> --fp16 --saveEngine=<plan>.
+    opset 12 is the newest the pinned torch 1.7 exporter can emit; raise it
+    only on newer torch.
+    """
+    root, ext = os.path.splitext(path)
+    if ext == ".onnx":
+        raise ValueError("path is the TensorRT module file; the ONNX export is written next to it as <root>.onnx")
+    onnx_path = root + ".onnx"
+
+    model.eval()
+    dummy = torch.randn(*input_size, device=next(model.parameters()).device)
+    with torch.no_grad():
+        torch.onnx.export(model, dummy, onnx_path, opset_version=opset_version, do_constant_folding=True,
+                          input_names=["input"], output_names=["output"])
+    try:
+        import torch_tensorrt
+    except ImportError:
+        return onnx_path
+
+    precisions = {torch.float}
+    if fp16:
+        precisions.add(torch.half)
+    calibrator = None
+    if int8_calib is not None:
+        precisions.add(torch.int8)
+        calibrator = torch_tensorrt.ptq.DataLoaderCalibrator(
+            int8_calib, use_cache=False, device=dummy.device,
+            algo_type=torch_tensorrt.ptq.CalibrationAlgo.ENTROPY_CALIBRATION_2)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, dummy)
+    trt_model = torch_tensorrt.compile(traced, inputs=[torch_tensorrt.Input(tuple(input_size))],
+                                       enabled_precisions=precisions, calibrator=calibrator)
+    torch.jit.save(trt_model, path)
+    return path
+
 
 def _mobilenet_v3_conf(
     arch: str, width_mult: float = 1.0, iw: int = 0, reduced_tail: bool = False, dilated: bool = False, **kwargs: Any
@@ -419,11 +687,52 @@ def _mobilenet_v3_conf(
     return inverted_residual_setting, last_channel
 
 
-def mobilenet_v3(pretrained: bool = False, progress: bool = True, **kwargs: Any,) -> MobileNetV3:
+def _rename_key(key: str) -> str:
+    for old, new in _torchvision_renames.items():
+        key = key.replace(old, new)
+    return key
+
+
+@lru_cache(maxsize=1)
+def _cached_state_dict(url: str, progress: bool = True):
+    # Shared by every pretrained build in this process; restoring copies the tensors, so it is never mutated.
+    state_dict = load_state_dict_from_url(url, progress=progress)
+    return {_rename_key(k): v for k, v in state_dict.items()}
+
+
+def mobilenet_v3(pretrained: bool = False, progress: bool = True, fuse: bool = False, channels_last: bool = False,
+                 compile: bool = False, compile_mode: str = "reduce-overhead", **kwargs: Any,) -> nn.Module:
+    """
+    Constructs a MobileNetV3-Small backbone.
+    Args:
+        pretrained (bool): If True, returns a model pre-trained on ImageNet
+        progress (bool): If True, displays a progress bar of the download to stderr
+        fuse (bool): If True, folds BatchNorm into the convs for inference
+        channels_last (bool): If True, stores the weights as NHWC; inputs must then be
+            converted with x.to(memory_format=torch.channels_last)
+        compile (bool): If True, returns the model wrapped with torch.compile using
+            compile_mode instead of the MobileNetV3 itself
+    Remaining keyword arguments (iw, fp16, width_mult, ...) are passed on to
+    _mobilenet_v3_conf and MobileNetV3; fp16=True makes MobileNetV3 run its
+    forward pass under CUDA autocast.
+    """
     inverted_residual_setting, last_channel = _mobilenet_v3_conf("mobilenet_v3_small", **kwargs)
     model = MobileNetV3(inverted_residual_setting, last_channel, **kwargs)
     if pretrained:
-        state_dict = load_state_dict_from_url(model_urls['mobilenet_v3'],
-                                              progress=progress)
-        forgiving_state_restore(model, state_dict)
+        state_dict = _cached_state_dict(model_urls['mobilenet_v3'], progress)
+        # drop tensors whose shape differs (e.g. another num_classes) and let strict=False skip the rest
+        own_state = model.state_dict()
+        state_dict = {k: v for k, v in state_dict.items() if k in own_state and own_state[k].shape == v.shape}
+        missing_keys, _ = model.load_state_dict(state_dict, strict=False)
+        for k in missing_keys:
+            print("Skipped loading parameter", k)
+    if fuse:
+        model.fuse()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    if compile:
+        # Lets Inductor fuse the Hardswish/SE elementwise chains into single kernels.
+        if not hasattr(torch, "compile"):
+            raise RuntimeError("compile=True requires torch>=2.0")
+        model = torch.compile(model, mode=compile_mode, fullgraph=False, backend="inductor")
     return model
@@ -309,13 +309,22 @@ class DeepV3Plus(nn.Module):
             resnet = MobilenetV3.mobilenet_v3(pretrained=True,
                     iw=self.args.wt_layer)
             print(resnet)
-            self.layer0 = nn.Sequential(resnet.features[0])
-            self.layer1 = nn.Sequential(resnet.features[1], resnet.features[2])
-            self.layer2 = nn.Sequential(resnet.features[3], resnet.features[4], resnet.features[5], resnet.features[6], resnet.features[7])
 
-            self.layer3 = nn.Sequential(resnet.features[8], resnet.features[9], resnet.features[10],
+            class Layer(nn.Sequential):
+                # MobileNetV3 blocks are Tensor -> Tensor; adapt them to the [x, w_arr] trunk interface
+                def forward(self, x_tuple):
+                    w_arr = x_tuple[1]
+                    with MobilenetV3.collect_whitening(w_arr):
+                        x = super(Layer, self).forward(x_tuple[0])
+                    return [x, w_arr]
+
+            self.layer0 = Layer(resnet.features[0])
+            self.layer1 = Layer(resnet.features[1], resnet.features[2])
+            self.layer2 = Layer(resnet.features[3], resnet.features[4], resnet.features[5], resnet.features[6], resnet.features[7])
+
+            self.layer3 = Layer(resnet.features[8], resnet.features[9], resnet.features[10],
                                         resnet.features[11])
-            self.layer4 = nn.Sequential(resnet.features[12])
+            self.layer4 = Layer(resnet.features[12])
 
             if self.variant == 'D':
                 for n, m in self.layer2.named_modules():